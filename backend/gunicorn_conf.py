@@ -0,0 +1,22 @@
+# Gunicorn configuration for production serving.
+# Run from the backend directory: gunicorn -c gunicorn_conf.py main:app
+import multiprocessing
+
+bind = '0.0.0.0:5000'
+workers = multiprocessing.cpu_count() * 2 + 1
+# Threaded workers so a slow LibreOffice conversion doesn't block printer/job polling
+worker_class = 'gthread'
+threads = 4
+# LibreOffice conversions of large documents can take a while
+timeout = 120
+
+
+def on_starting(server):
+    """Runs once in the master: starts the soffice listener pool shared by all workers."""
+    import main
+    main.start_soffice_listeners()
+
+
+def on_exit(server):
+    import main
+    main.stop_soffice_listeners()
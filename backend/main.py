@@ -1,41 +1,894 @@
 import os
+import re
+import time
+import mmap
+import stat
+import fcntl
+import signal
+import socket
+import queue
+import shutil
+import atexit
+import hashlib
+import itertools
+import tempfile
+import mimetypes
+import threading
 import subprocess
-from flask import Flask, request, jsonify, send_from_directory, render_template
+from pathlib import Path
+from contextlib import contextmanager
+from concurrent.futures import Future
+from flask import Flask, Response, abort, request, jsonify, send_from_directory, render_template
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+from werkzeug.wsgi import wrap_file
 import cups
 
+# BLAKE3 hashes several times faster than SHA-256 on large uploads; use it when installed
+try:
+    from blake3 import blake3 as upload_hash
+except ImportError:
+    upload_hash = hashlib.sha256
+
+# orjson encodes several times faster than the json module and produces bytes directly
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # --- Configuration ---
 UPLOAD_FOLDER = 'uploads'
 CONVERT_FOLDER = 'converts'
-ALLOWED_EXTENSIONS = {'pdf', 'txt', 'png', 'jpg', 'jpeg', 'gif', 'doc', 'docx'}
+UPLOAD_DIR = Path(UPLOAD_FOLDER)
+CONVERT_DIR = Path(CONVERT_FOLDER)
+# Uploads and converted PDFs are named by the hex digest of the upload's content
+CONTENT_HASH_RE = re.compile(r'[0-9a-f]{64}')
+ALLOWED_EXTENSIONS = frozenset({'.pdf', '.txt', '.png', '.jpg', '.jpeg', '.gif', '.doc', '.docx'})
+# Persistent LibreOffice listeners handling DOC/DOCX conversions: listener i serves
+# unoconvert on SOFFICE_PORT + i and talks to its soffice on SOFFICE_UNO_PORT + i
+SOFFICE_WORKERS = int(os.environ.get('SOFFICE_WORKERS', min(os.cpu_count() or 1, 4)))
+SOFFICE_PORT = int(os.environ.get('SOFFICE_PORT', 2003))
+SOFFICE_UNO_PORT = SOFFICE_PORT + 100
+# Each listener gets its own LibreOffice user profile under this directory, which
+# also holds the listeners' pid files; it must be private to the user running the app
+SOFFICE_RUN_DIR = Path(os.environ.get('SOFFICE_RUN_DIR') or Path(__file__).resolve().parent / 'soffice-run')
+# Listeners are restarted after this many conversions to keep soffice memory in check
+SOFFICE_RECYCLE_AFTER = 200
+# Seconds to wait for a (re)started listener to accept connections
+SOFFICE_START_TIMEOUT = 30
+# Seconds a recycled listener gets to shut down before it and its soffice are killed
+SOFFICE_KILL_GRACE = 10
+# Listeners that keep dying right after starting are respawned with growing delays up to this
+SOFFICE_RESPAWN_MAX_DELAY = 60
+# Seconds to wait for a single conversion before treating the listener as hung
+CONVERT_TIMEOUT = 120
+# Seconds a request waits for its queued conversion (a retry included); keep
+# nginx's proxy_read_timeout above this
+CONVERT_REQUEST_TIMEOUT = CONVERT_TIMEOUT * 3
+# Conversions requested within this many seconds of each other are handled as one batch
+CONVERT_BATCH_WINDOW = 0.1
+CONVERT_BATCH_SIZE = 10
+# Converted PDFs are kept (keyed by upload content) until the folder exceeds this size
+CONVERT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+# Conversions write into directories with this prefix inside CONVERT_FOLDER
+SCRATCH_PREFIX = '.convert-'
+# Conversions allowed to wait in line; beyond this, requests get a 503 with Retry-After
+CONVERT_QUEUE_LIMIT = 20
+CONVERT_RETRY_AFTER = 10
+# Seconds between checks of CONVERT_FOLDER while streaming an asynchronous preview's progress
+CONVERSION_POLL_INTERVAL = 0.5
+# Seconds the printer list and per-printer attributes are reused before asking CUPS again
+PRINTERS_CACHE_TTL = 5
+# Printer option sets rarely change, so their attributes are kept longer
+PRINTER_ATTRS_CACHE_TTL = 30
+# Largest accepted request body; matches client_max_body_size in nginx.conf.example
+MAX_UPLOAD_BYTES = 200 * 1024 * 1024
+# Chunk size used when streaming uploads to disk
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Uploads at least this large bypass the page cache (O_DIRECT) while being written
+DIRECT_IO_THRESHOLD = 64 * 1024 * 1024
+DIRECT_IO_ALIGNMENT = 4096
+# Fallback polling interval (seconds) for job status streams when IPP subscriptions are unavailable
+JOB_POLL_INTERVAL = 2
+# Seconds between keep-alive comments on idle event streams
+SSE_HEARTBEAT = 30
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+# Uploads and converted PDFs are named by content hash, so browsers may cache them forever
+CONTENT_ADDRESSED_MAX_AGE = 31536000
 
 # --- App Initialization ---
+class OrjsonProvider(DefaultJSONProvider):
+    """Backs jsonify() with orjson; the bytes go straight into the response body."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=self.default), mimetype=self.mimetype)
+
 app = Flask(__name__, static_folder='static', template_folder='templates')
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['CONVERT_FOLDER'] = CONVERT_FOLDER
+if orjson is not None:
+    app.json = OrjsonProvider(app)
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
+UPLOAD_DIR.mkdir(exist_ok=True)
+CONVERT_DIR.mkdir(exist_ok=True)
 # In production, CORS is not strictly necessary if the frontend is served by Flask,
 # but it's kept for flexibility during development.
 CORS(app, resources={r"/api/*": {"origins": "*"}})
 
 # --- Helper Functions ---
-def allowed_file(filename):
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+def allowed_file(file_ext):
+    """Checks a lowercased extension, as returned by os.path.splitext (leading dot included)."""
+    return file_ext in ALLOWED_EXTENSIONS
+
+def get_upload():
+    """Returns the (filename, stream) of the uploaded file, or (None, None) if there is none.
+
+    The raw request body is accepted too, named by `?filename=` or the X-Filename header.
+    """
+    if request.mimetype == 'multipart/form-data':
+        file = request.files.get('file')
+        if file is None:
+            return None, None
+        return file.filename, file.stream
+    filename = request.args.get('filename', request.headers.get('X-Filename'))
+    if filename is None:
+        return None, None
+    return filename, request.stream
+
+def _read_full(stream, buf):
+    """Fills `buf` from the stream and returns the byte count, which is short only at EOF."""
+    readinto = getattr(stream, 'readinto', None)
+    n = 0
+    while n < len(buf):
+        if readinto is not None:
+            got = readinto(buf[n:])
+        else:
+            data = stream.read(len(buf) - n)
+            got = len(data)
+            buf[n:n + got] = data
+        if not got:
+            break
+        n += got
+    return n
+
+def _enable_direct_io(fd):
+    """Switches fd to O_DIRECT; returns False where unsupported (tmpfs, non-Linux)."""
+    if not hasattr(os, 'O_DIRECT'):
+        return False
+    try:
+        fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_DIRECT)
+    except OSError:
+        return False
+    return True
+
+def save_upload(stream, upload_dir, ext, size_hint=None, direct=False):
+    """Streams the upload to disk under the hash of its content and returns the path.
+
+    `size_hint` preallocates the file; `direct` writes with O_DIRECT and drops the cached pages.
+    """
+    digest = upload_hash()
+    # One reusable, page-aligned buffer (as O_DIRECT requires) for all chunks
+    mm = mmap.mmap(-1, UPLOAD_CHUNK_SIZE)
+    buf = memoryview(mm)
+    fd, tmp_path = tempfile.mkstemp(dir=upload_dir, suffix='.part')
+    try:
+        if size_hint and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(fd, 0, size_hint)
+            except OSError:
+                pass
+        drop_cache = direct
+        direct = direct and _enable_direct_io(fd)
+        with open(fd, 'wb', buffering=0) as f:
+            while n := _read_full(stream, buf):
+                if direct and n % DIRECT_IO_ALIGNMENT:
+                    # The unaligned tail can't be written with O_DIRECT
+                    fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) & ~os.O_DIRECT)
+                    direct = False
+                with buf[:n] as chunk:
+                    digest.update(chunk)
+                    written = 0
+                    while written < n:
+                        written += f.write(chunk[written:])
+            # Drop any preallocated space the body turned out not to need
+            f.truncate()
+            if drop_cache and hasattr(os, 'posix_fadvise'):
+                # Only clean pages can be dropped, so flush the buffered tail first
+                os.fdatasync(fd)
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        upload_path = os.path.join(upload_dir, f"{digest.hexdigest()}{ext}")
+        os.replace(tmp_path, upload_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        buf.release()
+        mm.close()
+    return upload_path
+
+def accept_upload():
+    """Validates the uploaded file and saves it to UPLOAD_DIR.
+
+    Returns (filename, file_ext, upload_path, None), or (None, None, None, response)
+    with the error response to send if the request has no acceptable file.
+    """
+    filename, stream = get_upload()
+    if filename is None:
+        return None, None, None, (jsonify({"error": "No file part"}), 400)
+    if filename == '':
+        return None, None, None, (jsonify({"error": "No selected file"}), 400)
+    file_ext = os.path.splitext(filename)[1].lower()
+    if not allowed_file(file_ext):
+        return None, None, None, (jsonify({"error": "File type not allowed"}), 400)
+    # Only a raw body's length is the file's length; multipart adds its own framing.
+    # The length is the client's claim, so never preallocate more than we accept.
+    size_hint = None
+    if request.mimetype != 'multipart/form-data' and request.content_length:
+        size_hint = min(request.content_length, MAX_UPLOAD_BYTES)
+    direct = (request.content_length or 0) >= DIRECT_IO_THRESHOLD
+    return filename, file_ext, save_upload(stream, UPLOAD_DIR, file_ext, size_hint, direct), None
+
+def converter_busy():
+    """Response for when the conversion queue is full."""
+    return jsonify({"error": "Server is busy converting other documents."}), 503, {'Retry-After': str(CONVERT_RETRY_AFTER)}
+
+# --- LibreOffice Conversion ---
+# soffice takes a few seconds to boot, so instead of spawning it for every upload
+# we keep SOFFICE_WORKERS headless listeners (unoserver) running and submit
+# conversions to them with the lightweight `unoconvert` client. LibreOffice can't
+# run two conversions on one user profile, so every listener has its own profile
+# and port, which lets conversions run in parallel.
+_listeners = {}
+_listener_started = {}
+_listeners_stopping = threading.Event()
+# Pid of the process that started the pool; forked gunicorn workers inherit
+# _listeners and the atexit hook but must leave the listeners alone
+_listeners_owner = None
+
+def _ensure_private_dir(path):
+    """Creates `path` with mode 0700, refusing a directory that isn't ours."""
+    path.mkdir(mode=0o700, parents=True, exist_ok=True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid():
+        raise RuntimeError(f"{path} is not a directory owned by this user; refusing to use it.")
+    if stat.S_IMODE(st.st_mode) & 0o077:
+        os.chmod(path, 0o700)
+
+_ensure_private_dir(SOFFICE_RUN_DIR)
+
+def _slot_dir(i):
+    return SOFFICE_RUN_DIR / f'profile_{i}'
+
+def _pid_file(i):
+    return _slot_dir(i) / 'listener.pid'
+
+def _is_own_listener(pid, i):
+    """Tells whether `pid` is the unoserver we started for slot i (and not a reused pid)."""
+    try:
+        with open(f'/proc/{pid}/cmdline', 'rb') as f:
+            args = f.read().decode(errors='replace').split('\0')
+    except OSError:
+        return False
+    return (
+        any(os.path.basename(arg) == 'unoserver' for arg in args)
+        and _slot_dir(i).as_uri() in args
+        and str(SOFFICE_PORT + i) in args
+    )
+
+def _spawn_listener(i):
+    profile = _slot_dir(i)
+    profile.mkdir(mode=0o700, exist_ok=True)
+    proc = subprocess.Popen([
+        'unoserver', '--interface', '127.0.0.1',
+        '--port', str(SOFFICE_PORT + i), '--uno-port', str(SOFFICE_UNO_PORT + i),
+        '--user-installation', profile.as_uri(),
+    ])
+    # Lets any worker process recycle the listener (see _recycle_listener)
+    _pid_file(i).write_text(str(proc.pid))
+    _listeners[i] = proc
+    _listener_started[i] = time.monotonic()
+
+def _supervise_listeners():
+    """Restarts listeners that crashed or were recycled, backing off on ones that keep crashing."""
+    failures = {}
+    respawn_at = {}
+    while not _listeners_stopping.wait(1):
+        now = time.monotonic()
+        for i, proc in list(_listeners.items()):
+            if proc.poll() is None or _listeners_stopping.is_set():
+                continue
+            if i not in respawn_at:
+                # A listener dying before it could even have booted is broken, not recycled
+                if now - _listener_started[i] < SOFFICE_START_TIMEOUT:
+                    failures[i] = failures.get(i, 0) + 1
+                else:
+                    failures[i] = 0
+                delay = min(2 ** failures[i] - 1, SOFFICE_RESPAWN_MAX_DELAY)
+                respawn_at[i] = now + delay
+                print(f"LibreOffice listener {i} exited, restarting in {delay}s.")
+            if now >= respawn_at[i]:
+                del respawn_at[i]
+                _spawn_listener(i)
+
+def start_soffice_listeners():
+    """Starts the listener pool; this process then owns and supervises it."""
+    global _listeners_owner
+    _listeners_owner = os.getpid()
+    try:
+        for i in range(SOFFICE_WORKERS):
+            _spawn_listener(i)
+    except FileNotFoundError:
+        print("unoserver not found. DOC/DOCX conversions will start LibreOffice each time.")
+        stop_soffice_listeners()
+        return
+    print(f"Started {SOFFICE_WORKERS} LibreOffice listener(s) on ports {SOFFICE_PORT}-{SOFFICE_PORT + SOFFICE_WORKERS - 1}.")
+    threading.Thread(target=_supervise_listeners, daemon=True).start()
+
+def stop_soffice_listeners():
+    """Terminates the listeners if this process started them."""
+    if _listeners_owner != os.getpid():
+        return
+    _listeners_stopping.set()
+    for proc in _listeners.values():
+        proc.terminate()
+    for i, proc in _listeners.items():
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        _pid_file(i).unlink(missing_ok=True)
+    _listeners.clear()
+
+atexit.register(stop_soffice_listeners)
+
+# Worker processes (and their threads) share the slots (listener + profile), so a
+# slot is locked with flock while a conversion runs on it. flock locks belong to
+# the open file, so threads of one process exclude each other as well.
+_slot_rotation = itertools.count()
+_slot_conversions = [0] * SOFFICE_WORKERS
+
+def _open_slot_lock(i):
+    profile = _slot_dir(i)
+    profile.mkdir(mode=0o700, exist_ok=True)
+    return open(profile / 'slot.lock', 'a')
+
+@contextmanager
+def _checkout_slot():
+    """Locks a free listener/profile slot for one conversion, waiting only if all are busy."""
+    start = next(_slot_rotation)
+    order = [(start + k) % SOFFICE_WORKERS for k in range(SOFFICE_WORKERS)]
+    for i in order:
+        lock = _open_slot_lock(i)
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            break
+        except BlockingIOError:
+            lock.close()
+    else:
+        i = order[0]
+        lock = _open_slot_lock(i)
+        fcntl.flock(lock, fcntl.LOCK_EX)
+    with lock:
+        try:
+            yield i
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def _wait_for_listener(i, timeout=SOFFICE_START_TIMEOUT):
+    """Blocks until listener i accepts connections; returns False on timeout."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', SOFFICE_PORT + i), timeout=1).close()
+            return True
+        except OSError:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.2)
+
+def _listener_ready(i):
+    """Tells whether listener i is up, waiting for it while it is still starting."""
+    # Without a pid file no listener was started (e.g. not run with gunicorn_conf.py)
+    return _pid_file(i).exists() and _wait_for_listener(i)
+
+def _descendants(pid):
+    """Returns the pids of all processes below `pid`, read from /proc."""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The command name in parentheses may itself contain spaces
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    found, todo = [], [pid]
+    while todo:
+        for child in children.get(todo.pop(), []):
+            found.append(child)
+            todo.append(child)
+    return found
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+def _recycle_listener(i):
+    """Terminates listener i and waits until its owner has restarted it.
+
+    Must be called with slot i checked out.
+    """
+    try:
+        pid = int(_pid_file(i).read_text())
+        # The pid file may be stale and its pid reused by an unrelated process
+        if not _is_own_listener(pid, i):
+            return
+        # Collected up front: once unoserver is gone its soffice is reparented
+        family = [pid, *_descendants(pid)]
+        os.kill(pid, signal.SIGTERM)
+    except (OSError, ValueError):
+        return
+    print(f"Recycling LibreOffice listener {i}...")
+    deadline = time.monotonic() + CONVERT_TIMEOUT
+    grace = time.monotonic() + SOFFICE_KILL_GRACE
+    while time.monotonic() < grace and any(_alive(p) for p in family):
+        time.sleep(0.2)
+    # A wedged soffice ignores SIGTERM (and keeps the uno port from its replacement)
+    for p in family:
+        if _alive(p):
+            print(f"Killing unresponsive LibreOffice process {p}.")
+            try:
+                os.kill(p, signal.SIGKILL)
+            except OSError:
+                pass
+    _wait_for_listener(i, max(deadline - time.monotonic(), 0))
+
+def pdf_path_for(upload_path, outdir):
+    """Returns where LibreOffice writes the PDF converted from `upload_path`."""
+    return os.path.join(outdir, os.path.splitext(os.path.basename(upload_path))[0] + '.pdf')
+
+def libreoffice_command(i, outdir, paths):
+    """One-off `libreoffice --headless` conversion using slot i's profile."""
+    return [
+        'libreoffice', f'-env:UserInstallation={_slot_dir(i).as_uri()}',
+        '--headless', '--convert-to', 'pdf', '--outdir', os.fspath(outdir), *paths,
+    ]
+
+@contextmanager
+def _scratch_dir(outdir):
+    """Temporary directory inside `outdir` for LibreOffice's output, removed afterwards."""
+    scratch = tempfile.mkdtemp(prefix=SCRATCH_PREFIX, dir=outdir)
+    try:
+        yield scratch
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+def _publish_pdf(upload_path, scratch, outdir):
+    """Atomically moves the PDF converted from `upload_path` out of `scratch`."""
+    pdf_path = pdf_path_for(upload_path, outdir)
+    os.replace(pdf_path_for(upload_path, scratch), pdf_path)
+    return pdf_path
+
+def convert_to_pdf(upload_path, outdir):
+    """Converts a document to PDF and returns the PDF path.
+
+    A failed listener conversion is retried once after restarting the listener;
+    without a listener, LibreOffice is run directly.
+    """
+    with _checkout_slot() as i, _scratch_dir(outdir) as scratch:
+        if shutil.which('unoconvert') is None or not _listener_ready(i):
+            cmd = libreoffice_command(i, scratch, [upload_path])
+            subprocess.run(cmd, check=True, timeout=CONVERT_TIMEOUT)
+        else:
+            cmd = ['unoconvert', '--host', '127.0.0.1', '--port', str(SOFFICE_PORT + i),
+                   '--convert-to', 'pdf', upload_path, pdf_path_for(upload_path, scratch)]
+            try:
+                subprocess.run(cmd, check=True, timeout=CONVERT_TIMEOUT)
+            except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+                print(f"Conversion via listener {i} failed ({e}), retrying after restart.")
+                _recycle_listener(i)
+                _slot_conversions[i] = 0
+                subprocess.run(cmd, check=True, timeout=CONVERT_TIMEOUT)
+            _slot_conversions[i] += 1
+            if _slot_conversions[i] >= SOFFICE_RECYCLE_AFTER:
+                _recycle_listener(i)
+                _slot_conversions[i] = 0
+        if not os.path.exists(pdf_path_for(upload_path, scratch)):
+            # LibreOffice exits successfully without output for documents it can't read
+            raise subprocess.CalledProcessError(0, cmd)
+        return _publish_pdf(upload_path, scratch, outdir)
+
+class ConversionCoalescer:
+    """Runs conversions on SOFFICE_WORKERS threads, batching requests that arrive together.
+
+    `submit` raises queue.Full once CONVERT_QUEUE_LIMIT conversions are waiting.
+    """
+
+    def __init__(self, outdir, window=CONVERT_BATCH_WINDOW, max_batch=CONVERT_BATCH_SIZE):
+        self.outdir = outdir
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.Queue(maxsize=CONVERT_QUEUE_LIMIT)
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def submit(self, upload_path):
+        """Queues a conversion and returns a Future resolving to the PDF path."""
+        future = Future()
+        pdf_path = pdf_path_for(upload_path, self.outdir)
+        if os.path.exists(pdf_path):
+            # Cache hit; bump the mtime so eviction treats it as recently used
+            os.utime(pdf_path)
+            future.set_result(pdf_path)
+            return future
+        # The threads are started lazily so they live in the process serving requests
+        # (gunicorn forks workers after import).
+        with self._lock:
+            if not self._threads:
+                for _ in range(SOFFICE_WORKERS):
+                    thread = threading.Thread(target=self._worker, daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+        self._queue.put_nowait((upload_path, future))
+        return future
+
+    def convert(self, upload_path, timeout=None):
+        """Converts a document and blocks until its PDF is ready."""
+        return self.submit(upload_path).result(timeout=timeout)
+
+    def _worker(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            # One bad iteration must not take the thread, and with it the pool, down
+            try:
+                self._run(batch)
+            except Exception as e:
+                print(f"Conversion batch failed unexpectedly: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            try:
+                self._evict()
+            except Exception as e:
+                print(f"Evicting converted PDFs failed: {e}")
+
+    def _run(self, batch):
+        # Identical documents queued twice may have been converted by an earlier batch
+        batched = {path for path, _ in batch if os.path.exists(pdf_path_for(path, self.outdir))}
+        paths = [path for path in dict.fromkeys(path for path, _ in batch) if path not in batched]
+        if len(paths) > 1 and shutil.which('unoconvert') is None:
+            try:
+                with _checkout_slot() as i, _scratch_dir(self.outdir) as scratch:
+                    subprocess.run(
+                        libreoffice_command(i, scratch, paths),
+                        check=True, timeout=CONVERT_TIMEOUT * len(paths)
+                    )
+                    # Only a run that exited cleanly has finished writing its PDFs
+                    for path in paths:
+                        if os.path.exists(pdf_path_for(path, scratch)):
+                            _publish_pdf(path, scratch, self.outdir)
+                            batched.add(path)
+            except (subprocess.SubprocessError, OSError) as e:
+                print(f"Batch conversion failed ({e}), converting files individually.")
+
+        results = {}
+        for path, future in batch:
+            if path not in results:
+                if path in batched:
+                    results[path] = (pdf_path_for(path, self.outdir), None)
+                else:
+                    try:
+                        results[path] = (convert_to_pdf(path, self.outdir), None)
+                    except Exception as e:
+                        results[path] = (None, e)
+            pdf_path, error = results[path]
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(pdf_path)
+
+    def _evict(self):
+        """Deletes the least recently used PDFs beyond CONVERT_CACHE_MAX_BYTES and orphaned scratch dirs."""
+        entries = []
+        now = time.time()
+        with os.scandir(self.outdir) as it:
+            for entry in it:
+                # Scratch directories and evicted PDFs vanish under us all the time
+                try:
+                    if entry.name.startswith(SCRATCH_PREFIX):
+                        if entry.stat().st_mtime < now - CONVERT_TIMEOUT * (CONVERT_BATCH_SIZE + 1):
+                            shutil.rmtree(entry.path, ignore_errors=True)
+                    elif entry.is_file():
+                        st = entry.stat()
+                        entries.append((st.st_mtime, st.st_size, entry.path))
+                except FileNotFoundError:
+                    continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= CONVERT_CACHE_MAX_BYTES:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+converter = ConversionCoalescer(CONVERT_DIR)
+
+# Conversions started with /api/preview?async=1 are identified by the upload's
+# content hash, and their progress is read back from CONVERT_FOLDER so that any
+# worker process can report on a conversion queued by another one: the job is
+# done once <hash>.pdf exists and has failed while <hash>.error exists.
+def conversion_error_path(job_id):
+    return CONVERT_DIR / f'{job_id}.error'
+
+def conversion_error_message(error):
+    """Turns a failed conversion into the message sent to the frontend."""
+    if isinstance(error, FileNotFoundError):
+        print("LibreOffice not found. Please ensure it is installed and in the system's PATH.")
+        return "File conversion utility not found on server."
+    print(f"Error during conversion: {error}")
+    return "Failed to convert document to PDF."
+
+def start_conversion_job(upload_path):
+    """Queues an asynchronous conversion and returns its job id."""
+    job_id = Path(upload_path).stem
+    error_path = conversion_error_path(job_id)
+    # An earlier failure of the same document must not stand in for this attempt
+    error_path.unlink(missing_ok=True)
+
+    def record_failure(future):
+        if future.exception() is not None:
+            error_path.write_text(conversion_error_message(future.exception()))
+
+    converter.submit(upload_path).add_done_callback(record_failure)
+    return job_id
+
+def conversion_status(job_id):
+    """Reads the state of an asynchronous conversion from CONVERT_FOLDER."""
+    if (CONVERT_DIR / f'{job_id}.pdf').exists():
+        return {"state": "done", "preview_path": f"/api/converted/{job_id}.pdf"}
+    try:
+        error = conversion_error_path(job_id).read_text()
+    except FileNotFoundError:
+        return {"state": "converting"}
+    return {"state": "error", "error": error or "Failed to convert document to PDF."}
+
+# --- CUPS Helpers ---
+# pycups connections are not thread-safe, so every worker thread keeps its own
+# connection instead of opening a new one per request.
+_tls = threading.local()
+_printers_lock = threading.Lock()
+_printers_cache = {'t': 0.0, 'names': (), 'lookup': frozenset()}
+_printer_attrs_cache = {}
+
+def _cups_conn():
+    if not hasattr(_tls, 'c'):
+        _tls.c = cups.Connection()
+    return _tls.c
+
+def _reset_cups_conn():
+    """Drops this thread's connection so the next call reconnects."""
+    _tls.__dict__.pop('c', None)
+
+def get_printer_names(refresh=False):
+    """Returns the CUPS printer names, asking CUPS at most once per PRINTERS_CACHE_TTL."""
+    with _printers_lock:
+        if refresh or time.monotonic() - _printers_cache['t'] > PRINTERS_CACHE_TTL:
+            names = tuple(_cups_conn().getPrinters())
+            _printers_cache.update(t=time.monotonic(), names=names, lookup=frozenset(names))
+        return _printers_cache['names']
+
+def printer_exists(printer_name):
+    """Checks the cached printer set, refreshing once on a miss in case a queue was just added."""
+    get_printer_names()
+    if printer_name in _printers_cache['lookup']:
+        return True
+    get_printer_names(refresh=True)
+    return printer_name in _printers_cache['lookup']
+
+# The only printer attributes the frontend needs; asking for just these keeps CUPS
+# from serializing every attribute the printer supports.
+PRINTER_OPTION_ATTRIBUTES = [
+    'media-supported',
+    'print-quality-supported',
+    'sides-supported',
+    'print-color-mode-supported',
+]
+# 'print-quality' is an IPP integer enum; these are the names used by the frontend
+PRINT_QUALITIES = {3: 'draft', 4: 'normal', 5: 'high'}
+PRINT_QUALITY_VALUES = {name: str(value) for value, name in PRINT_QUALITIES.items()}
+
+def get_printer_attributes(printer_name):
+    """Returns the (cached) option attributes of a printer."""
+    cached = _printer_attrs_cache.get(printer_name)
+    if cached and time.monotonic() - cached[0] <= PRINTER_ATTRS_CACHE_TTL:
+        return cached[1]
+    attrs = _cups_conn().getPrinterAttributes(printer_name, requested_attributes=PRINTER_OPTION_ATTRIBUTES)
+    _printer_attrs_cache[printer_name] = (time.monotonic(), attrs)
+    return attrs
+
+def invalidate_printer_cache():
+    """Forces the next lookup to ask CUPS again."""
+    with _printers_lock:
+        _printers_cache['t'] = 0.0
+    _printer_attrs_cache.clear()
+
+# --- Print Job Status ---
+# CUPS job states: 3=pending, 4=pending-held, 5=processing, 6=processing-stopped, 7=canceled, 8=aborted, 9=completed
+JOB_STATES = {
+    3: 'pending',
+    4: 'pending-held',
+    5: 'processing',
+    6: 'processing-stopped',
+    7: 'canceled',
+    8: 'aborted',
+    9: 'completed'
+}
+FINAL_JOB_STATES = {'canceled', 'aborted', 'completed'}
+# Only ask CUPS for what we report instead of every job attribute
+JOB_STATUS_ATTRIBUTES = ['job-id', 'job-state', 'job-state-reasons']
+
+def job_status(job_id):
+    """Returns the status of a print job as sent to the frontend."""
+    try:
+        job_attrs = _cups_conn().getJobAttributes(job_id, requested_attributes=JOB_STATUS_ATTRIBUTES)
+    except cups.IPPError:
+        # This specific error often means the job doesn't exist.
+        return {"job_id": job_id, "state": "completed", "reason": "not-found-ipp-error"}
+
+    if not job_attrs:
+        # This can happen if the job ID is very old and purged from CUPS history
+        return {"job_id": job_id, "state": "completed", "reason": "not-found-or-purged"}
+
+    return {
+        "job_id": job_id,
+        "state": JOB_STATES.get(job_attrs.get('job-state'), 'unknown'),
+        "reason": job_attrs.get('job-state-reasons', 'none')
+    }
+
+class JobWatcher:
+    """Pushes job state changes to event-stream subscribers, with one watcher thread per job."""
+
+    def __init__(self):
+        self._subscribers = {}
+        # The thread currently watching each job; at most one per job
+        self._watchers = {}
+        self._last = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, job_id):
+        """Returns a queue receiving status dicts for the job, starting with the latest one."""
+        q = queue.Queue()
+        watcher = None
+        with self._lock:
+            self._subscribers.setdefault(job_id, []).append(q)
+            if job_id in self._last:
+                q.put(self._last[job_id])
+            if job_id not in self._watchers:
+                watcher = threading.Thread(target=self._watch, args=(job_id,), daemon=True)
+                self._watchers[job_id] = watcher
+        if watcher is not None:
+            watcher.start()
+        return q
+
+    def unsubscribe(self, job_id, q):
+        with self._lock:
+            subscribers = self._subscribers.get(job_id, [])
+            if q in subscribers:
+                subscribers.remove(q)
 
-def ensure_dir(directory):
-    if not os.path.exists(directory):
-        os.makedirs(directory)
+    def _publish(self, job_id, status):
+        with self._lock:
+            if self._last.get(job_id) == status:
+                return
+            self._last[job_id] = status
+            for q in self._subscribers.get(job_id, []):
+                q.put(status)
+
+    def _is_watched(self, job_id):
+        with self._lock:
+            if self._subscribers.get(job_id):
+                return True
+            # Nobody is listening any more; the thread exits and a new subscriber starts a fresh one
+            self._forget(job_id)
+            return False
+
+    def _forget(self, job_id):
+        """Drops all state of a job; called with the lock held."""
+        self._subscribers.pop(job_id, None)
+        self._last.pop(job_id, None)
+        self._watchers.pop(job_id, None)
+
+    def _watch(self, job_id):
+        sub_id = None
+        try:
+            status = job_status(job_id)
+            self._publish(job_id, status)
+            try:
+                sub_id = _cups_conn().createSubscription(
+                    '/', events=['job-state-changed'], job_id=job_id, lease_duration=3600
+                )
+            except cups.IPPError as e:
+                print(f"IPP subscription for job {job_id} unavailable ({e}), falling back to polling.")
+            sequence = 0
+            while status['state'] not in FINAL_JOB_STATES and self._is_watched(job_id):
+                interval = JOB_POLL_INTERVAL
+                if sub_id is None:
+                    status = job_status(job_id)
+                    self._publish(job_id, status)
+                else:
+                    try:
+                        notifications = _cups_conn().getNotifications([sub_id], [sequence + 1])
+                    except (cups.IPPError, RuntimeError) as e:
+                        # The lease expired or cupsd restarted and forgot the subscription
+                        print(f"IPP subscription for job {job_id} lost ({e}), falling back to polling.")
+                        if isinstance(e, RuntimeError):
+                            _reset_cups_conn()
+                        sub_id = None
+                        continue
+                    for event in notifications.get('events', []):
+                        sequence = max(sequence, event.get('notify-sequence-number', sequence))
+                        if 'job-state' in event:
+                            status = {
+                                "job_id": job_id,
+                                "state": JOB_STATES.get(event['job-state'], 'unknown'),
+                                "reason": event.get('job-state-reasons', 'none')
+                            }
+                            self._publish(job_id, status)
+                    interval = min(notifications.get('notify-get-interval', interval), interval)
+                if status['state'] not in FINAL_JOB_STATES:
+                    time.sleep(interval)
+        except RuntimeError as e:
+            _reset_cups_conn()
+            print(f"CUPS connection failed while watching job {job_id}: {e}")
+            self._publish(job_id, {"job_id": job_id, "error": "Could not connect to CUPS to check job status."})
+        except Exception as e:
+            # Publish something final so open streams close instead of idling on heartbeats
+            print(f"An unexpected error occurred while watching job {job_id}: {e}")
+            self._publish(job_id, {"job_id": job_id, "error": "An unexpected error occurred while checking job status."})
+        finally:
+            if sub_id is not None:
+                try:
+                    _cups_conn().cancelSubscription(sub_id)
+                except (cups.IPPError, RuntimeError):
+                    pass
+            with self._lock:
+                # Forget the job unless a newer watcher has taken over in the meantime
+                if self._watchers.get(job_id) is threading.current_thread():
+                    self._forget(job_id)
+
+job_watcher = JobWatcher()
 
 # --- API Routes ---
 @app.route('/api/printers', methods=['GET'])
 def get_printers():
     """Returns a list of available CUPS printers."""
     try:
-        conn = cups.Connection()
-        printers = conn.getPrinters()
         # Returning a list of printer names
-        return jsonify(list(printers.keys()))
+        return jsonify(list(get_printer_names()))
     except RuntimeError:
+        _reset_cups_conn()
         # Fallback for environments without a running CUPS server
         print("CUPS connection failed. Returning dummy printer list.")
         return jsonify(["dummy_printer_1", "dummy_printer_2"])
@@ -47,13 +900,11 @@ def get_printers():
 def get_printer_options(printer_name):
     """Gets the supported options for a specific printer."""
     try:
-        conn = cups.Connection()
         # Ensure the printer exists before getting attributes
-        printers = conn.getPrinters()
-        if printer_name not in printers:
+        if not printer_exists(printer_name):
             return jsonify({"error": "Printer not found."}), 404
             
-        attrs = conn.getPrinterAttributes(printer_name)
+        attrs = get_printer_attributes(printer_name)
         
         # Extracting common useful options
         # Note: The keys like "media-supported" might vary slightly between CUPS versions/drivers.
@@ -67,12 +918,12 @@ def get_printer_options(printer_name):
 
         # The value for 'print-quality-supported' is often an integer enum.
         # We can provide a mapping to human-readable names.
-        quality_map = {3: 'draft', 4: 'normal', 5: 'high'}
         if options["print_quality_supported"]:
-            options["print_quality_supported"] = [quality_map.get(q, 'unknown') for q in options["print_quality_supported"]]
+            options["print_quality_supported"] = [PRINT_QUALITIES.get(q, 'unknown') for q in options["print_quality_supported"]]
 
         return jsonify(options)
     except RuntimeError as e:
+        _reset_cups_conn()
         print(f"CUPS connection failed while getting options: {e}")
         return jsonify({"error": "Could not connect to CUPS to get printer options."}), 500
     except Exception as e:
@@ -82,197 +933,262 @@ def get_printer_options(printer_name):
 
 @app.route('/api/print', methods=['POST'])
 def print_document():
-    """Handles the print request."""
-    if 'file' not in request.files:
-        return jsonify({"error": "No file part"}), 400
-    
-    file = request.files['file']
-    printer_name = request.form.get('printer')
-    copies = int(request.form.get('copies', 1))
-    # Get additional print options from the form
-    page_range = request.form.get('page_range')
-    paper_size = request.form.get('paper_size', 'A4') # Default to A4
-    color_mode = request.form.get('color_mode', 'color') # Default to color
-    print_quality = request.form.get('print_quality') # Get print quality
-    sides = request.form.get('sides') # For duplex printing
-
-    if file.filename == '':
-        return jsonify({"error": "No selected file"}), 400
+    """Handles the print request; options come from the query string if `printer` is there, else the form."""
+    params = request.args if 'printer' in request.args else request.form
+    printer_name = params.get('printer')
+    copies = int(params.get('copies', 1))
+    # Get additional print options
+    page_range = params.get('page_range')
+    paper_size = params.get('paper_size', 'A4') # Default to A4
+    color_mode = params.get('color_mode', 'color') # Default to color
+    print_quality = params.get('print_quality') # Get print quality
+    sides = params.get('sides') # For duplex printing
+
     if not printer_name:
         return jsonify({"error": "No printer selected"}), 400
 
-    if file and allowed_file(file.filename):
-        filename = file.filename
-        upload_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(upload_path)
+    filename, file_ext, upload_path, error = accept_upload()
+    if error:
+        return error
 
-        file_to_print = upload_path
-        file_ext = filename.rsplit('.', 1)[1].lower()
+    file_to_print = upload_path
 
-        # Convert if necessary
-        if file_ext in ['doc', 'docx']:
-            try:
-                pdf_filename = os.path.splitext(filename)[0] + '.pdf'
-                pdf_path = os.path.join(app.config['CONVERT_FOLDER'], pdf_filename)
-                subprocess.run(
-                    ['libreoffice', '--headless', '--convert-to', 'pdf', '--outdir', app.config['CONVERT_FOLDER'], upload_path],
-                    check=True
-                )
-                file_to_print = pdf_path
-            except (subprocess.CalledProcessError, FileNotFoundError) as e:
-                print(f"Conversion failed during print request: {e}")
-                return jsonify({"error": "Failed to convert document for printing."}), 500
-
-        # Submit to CUPS
+    # Convert if necessary
+    if file_ext in ('.doc', '.docx'):
         try:
-            conn = cups.Connection()
-            printers = conn.getPrinters()
-            if printer_name not in printers:
-                return jsonify({"error": f"Printer '{printer_name}' not found."}), 404
-            
-            # Build the options dictionary for CUPS
-            print_options = {
-                'copies': str(copies),
-                'media': paper_size,
-                'print-color-mode': color_mode
-            }
-            if page_range:
-                # CUPS expects 'page-ranges' for specifying pages
-                print_options['page-ranges'] = page_range
-            if print_quality:
-                # Map quality names back to CUPS integer values
-                quality_map_inv = {'draft': '3', 'normal': '4', 'high': '5'}
-                if print_quality in quality_map_inv:
-                    print_options['print-quality'] = quality_map_inv[print_quality]
-            
-            if sides:
-                print_options['sides'] = sides
+            file_to_print = converter.convert(upload_path, timeout=CONVERT_REQUEST_TIMEOUT)
+        except queue.Full:
+            return converter_busy()
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired, TimeoutError, FileNotFoundError) as e:
+            print(f"Conversion failed during print request: {e}")
+            return jsonify({"error": "Failed to convert document for printing."}), 500
 
-            job_id = conn.printFile(printer_name, file_to_print, f"WebApp Print - {filename}", print_options)
-            return jsonify({"status": "success", "job_id": job_id})
+    # Submit to CUPS
+    try:
+        # Build the options dictionary for CUPS
+        print_options = {
+            'copies': str(copies),
+            'media': paper_size,
+            'print-color-mode': color_mode
+        }
+        if page_range:
+            # CUPS expects 'page-ranges' for specifying pages
+            print_options['page-ranges'] = page_range
+        if print_quality:
+            # Map quality names back to CUPS integer values
+            if print_quality in PRINT_QUALITY_VALUES:
+                print_options['print-quality'] = PRINT_QUALITY_VALUES[print_quality]
+        
+        if sides:
+            print_options['sides'] = sides
 
-        except RuntimeError as e:
-            print(f"CUPS connection failed during print: {e}")
-            # In a no-CUPS environment, we can't proceed.
-            return jsonify({"error": "Could not connect to CUPS printing service."}), 500
-        except Exception as e:
-            print(f"An unexpected error occurred during printing: {e}")
-            return jsonify({"error": "An unexpected error occurred during printing."}), 500
+        # No separate existence check: CUPS rejects unknown printers itself
+        try:
+            job_id = _cups_conn().printFile(printer_name, file_to_print, f"WebApp Print - {filename}", print_options)
+        except cups.IPPError as e:
+            # The cached printer list may be stale (e.g. a queue was removed)
+            invalidate_printer_cache()
+            if e.args and e.args[0] == cups.IPP_NOT_FOUND:
+                return jsonify({"error": f"Printer '{printer_name}' not found."}), 404
+            raise
+        return jsonify({"status": "success", "job_id": job_id})
 
-    return jsonify({"error": "File type not allowed"}), 400
+    except RuntimeError as e:
+        _reset_cups_conn()
+        print(f"CUPS connection failed during print: {e}")
+        # In a no-CUPS environment, we can't proceed.
+        return jsonify({"error": "Could not connect to CUPS printing service."}), 500
+    except Exception as e:
+        print(f"An unexpected error occurred during printing: {e}")
+        return jsonify({"error": "An unexpected error occurred during printing."}), 500
 
 
 @app.route('/api/preview', methods=['POST'])
 def preview_document():
-    """Handles file upload, converts DOCX to PDF, and returns the path for preview."""
-    if 'file' not in request.files:
-        return jsonify({"error": "No file part"}), 400
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({"error": "No selected file"}), 400
-
-    if file and allowed_file(file.filename):
-        filename = file.filename
-        upload_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(upload_path)
-
-        file_ext = filename.rsplit('.', 1)[1].lower()
-
-        if file_ext in ['doc', 'docx']:
-            # Convert to PDF using LibreOffice
-            try:
-                subprocess.run(
-                    ['libreoffice', '--headless', '--convert-to', 'pdf', '--outdir', app.config['CONVERT_FOLDER'], upload_path],
-                    check=True
-                )
-                pdf_filename = os.path.splitext(filename)[0] + '.pdf'
-                # The converted file will be in the CONVERT_FOLDER
-                return jsonify({"preview_path": f"/api/converted/{pdf_filename}"})
-            except subprocess.CalledProcessError as e:
-                print(f"Error during conversion: {e}")
-                return jsonify({"error": "Failed to convert document to PDF."}), 500
-            except FileNotFoundError:
-                print("LibreOffice not found. Please ensure it is installed and in the system's PATH.")
-                return jsonify({"error": "File conversion utility not found on server."}), 500
-        
-        # For PDFs, we can preview them directly from the uploads folder
-        elif file_ext == 'pdf':
-            return jsonify({"preview_path": f"/api/uploads/{filename}"})
-        
-        # For other file types, we don't have a preview handler yet
-        else:
-            return jsonify({"error": "Preview for this file type is not supported."}), 400
+    """Handles file upload, converts DOCX to PDF, and returns the path for preview.
+
+    With `?async=1`, DOC/DOCX uploads get a `job_id` for /api/preview/progress instead.
+    """
+    _, file_ext, upload_path, error = accept_upload()
+    if error:
+        return error
+
+    if file_ext in ('.doc', '.docx'):
+        # Convert to PDF using LibreOffice
+        try:
+            if request.args.get('async') == '1':
+                job_id = start_conversion_job(upload_path)
+                return jsonify({"job_id": job_id}), 202
+            pdf_path = converter.convert(upload_path, timeout=CONVERT_REQUEST_TIMEOUT)
+            # The converted file will be in the CONVERT_FOLDER
+            return jsonify({"preview_path": f"/api/converted/{os.path.basename(pdf_path)}"})
+        except queue.Full:
+            return converter_busy()
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired, TimeoutError) as e:
+            print(f"Error during conversion: {e}")
+            return jsonify({"error": "Failed to convert document to PDF."}), 500
+        except FileNotFoundError:
+            print("LibreOffice not found. Please ensure it is installed and in the system's PATH.")
+            return jsonify({"error": "File conversion utility not found on server."}), 500
+    
+    # For PDFs, we can preview them directly from the uploads folder
+    elif file_ext == '.pdf':
+        return jsonify({"preview_path": f"/api/uploads/{os.path.basename(upload_path)}"})
+    
+    # For other file types, we don't have a preview handler yet
+    else:
+        return jsonify({"error": "Preview for this file type is not supported."}), 400
+
+
+@app.route('/api/preview/progress/<job_id>', methods=['GET'])
+def preview_progress(job_id):
+    """Streams the outcome of an asynchronous preview conversion as server-sent events."""
+    if not CONTENT_HASH_RE.fullmatch(job_id):
+        return jsonify({"error": "Conversion job not found."}), 404
+    status = conversion_status(job_id)
+    if status['state'] == 'converting' and not any(
+        (UPLOAD_DIR / f'{job_id}{ext}').exists() for ext in ('.doc', '.docx')
+    ):
+        return jsonify({"error": "Conversion job not found."}), 404
+
+    def generate():
+        current = status
+        if current['state'] == 'converting':
+            yield f"data: {app.json.dumps(current)}\n\n"
+        # Conversions lost with a restarted worker would otherwise keep the stream open forever
+        deadline = time.monotonic() + CONVERT_REQUEST_TIMEOUT
+        heartbeat = time.monotonic() + SSE_HEARTBEAT
+        while current['state'] == 'converting':
+            if time.monotonic() >= deadline:
+                current = {"state": "error", "error": "Failed to convert document to PDF."}
+                break
+            time.sleep(CONVERSION_POLL_INTERVAL)
+            if time.monotonic() >= heartbeat:
+                yield ": heartbeat\n\n"
+                heartbeat += SSE_HEARTBEAT
+            current = conversion_status(job_id)
+        yield f"data: {app.json.dumps(current)}\n\n"
 
-    return jsonify({"error": "File type not allowed"}), 400
+    return Response(generate(), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+
+def send_content_addressed(directory, filename, extensions):
+    """Serves a hash-named file via wsgi.file_wrapper with Range support and immutable cache headers."""
+    stem, ext = os.path.splitext(filename)
+    if not CONTENT_HASH_RE.fullmatch(stem) or ext not in extensions:
+        abort(404)
+    path = os.path.join(directory, filename)
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+        abort(404)
+    try:
+        st = os.fstat(fd)
+        if not stat.S_ISREG(st.st_mode):
+            abort(404)
+        if hasattr(os, 'posix_fadvise'):
+            # The file is read front to back; let the kernel read ahead aggressively
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        f = os.fdopen(fd, 'rb')
+    except BaseException:
+        os.close(fd)
+        raise
+    resp = Response(
+        wrap_file(request.environ, f, UPLOAD_CHUNK_SIZE),
+        mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+        direct_passthrough=True,
+    )
+    resp.content_length = st.st_size
+    resp.last_modified = st.st_mtime
+    resp.set_etag(stem)
+    resp.cache_control.public = True
+    resp.cache_control.max_age = CONTENT_ADDRESSED_MAX_AGE
+    resp.cache_control.immutable = True
+    return resp.make_conditional(request.environ, accept_ranges=True, complete_length=st.st_size)
 
 
 @app.route('/api/uploads/<path:filename>')
 def get_uploaded_file(filename):
     """Serves uploaded files."""
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    return send_content_addressed(UPLOAD_DIR, filename, ALLOWED_EXTENSIONS)
 
 
 @app.route('/api/converted/<path:filename>')
 def get_converted_file(filename):
     """Serves converted PDF files."""
-    return send_from_directory(app.config['CONVERT_FOLDER'], filename)
+    return send_content_addressed(CONVERT_DIR, filename, ('.pdf',))
 
 
 @app.route('/api/jobs/<int:job_id>', methods=['GET'])
 def get_job_status(job_id):
     """Gets the status of a print job using a more reliable method."""
     try:
-        conn = cups.Connection()
-        job_attrs = conn.getJobAttributes(job_id)
-        
-        if not job_attrs:
-            # This can happen if the job ID is very old and purged from CUPS history
-            return jsonify({"job_id": job_id, "state": "completed", "reason": "not-found-or-purged"})
-
-        # CUPS job states: 3=pending, 4=pending-held, 5=processing, 6=processing-stopped, 7=canceled, 8=aborted, 9=completed
-        status_map = {
-            3: 'pending',
-            4: 'pending-held',
-            5: 'processing',
-            6: 'processing-stopped',
-            7: 'canceled',
-            8: 'aborted',
-            9: 'completed'
-        }
-        
-        state = job_attrs.get('job-state')
-        state_reason = job_attrs.get('job-state-reasons', 'none')
-        
-        return jsonify({
-            "job_id": job_id,
-            "state": status_map.get(state, 'unknown'),
-            "reason": state_reason
-        })
-    except cups.IPPError:
-        # This specific error often means the job doesn't exist.
-        return jsonify({"job_id": job_id, "state": "completed", "reason": "not-found-ipp-error"})
+        return jsonify(job_status(job_id))
     except RuntimeError as e:
+        _reset_cups_conn()
         print(f"CUPS connection failed during job status check: {e}")
         return jsonify({"error": "Could not connect to CUPS to check job status."}), 500
     except Exception as e:
         print(f"An unexpected error occurred during job status check: {e}")
         return jsonify({"error": f"An unexpected error occurred: {e}"}), 500
 
+
+@app.route('/api/jobs/<int:job_id>/stream', methods=['GET'])
+def stream_job_status(job_id):
+    """Streams status changes of a print job as server-sent events until it finishes."""
+    q = job_watcher.subscribe(job_id)
+
+    def generate():
+        try:
+            while True:
+                try:
+                    status = q.get(timeout=SSE_HEARTBEAT)
+                except queue.Empty:
+                    yield ": heartbeat\n\n"
+                    continue
+                yield f"data: {app.json.dumps(status)}\n\n"
+                if 'error' in status or status['state'] in FINAL_JOB_STATES:
+                    return
+        finally:
+            job_watcher.unsubscribe(job_id, q)
+
+    return Response(generate(), mimetype='text/event-stream', headers=SSE_HEADERS)
+
 # --- Frontend Serving ---
+# The built frontend only changes on deploy, so its files are indexed once instead
+# of stat()ing the disk on every page load. Set STATIC_RESCAN=1 while developing
+# to pick up rebuilt assets without restarting.
+STATIC_RESCAN = os.environ.get('STATIC_RESCAN') == '1'
+
+def _scan_static():
+    return frozenset(
+        os.path.relpath(os.path.join(root, f), app.static_folder).replace(os.sep, '/')
+        for root, _, files in os.walk(app.static_folder) for f in files
+    )
+
+_static_files = _scan_static()
+
+def _rescan_static():
+    global _static_files
+    _static_files = _scan_static()
+
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve(path):
     """Serves the frontend application."""
+    if STATIC_RESCAN and path not in _static_files:
+        _rescan_static()
     # Let the API routes handle themselves
-    if path != "" and os.path.exists(os.path.join(app.static_folder, path)):
+    if path in _static_files:
         return send_from_directory(app.static_folder, path)
     # For any other path, serve the main index.html
     else:
         return render_template("index.html")
 
 # --- Main Execution ---
+# The built-in server handles one request at a time and is meant for development.
+# In production run: gunicorn -c gunicorn_conf.py main:app (optionally behind nginx,
+# see nginx.conf.example).
 if __name__ == '__main__':
-    ensure_dir(UPLOAD_FOLDER)
-    ensure_dir(CONVERT_FOLDER)
-    # Set debug=False for production serving
+    start_soffice_listeners()
     app.run(host='0.0.0.0', port=5000, debug=False)